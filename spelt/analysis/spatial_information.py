@@ -29,8 +29,8 @@ def spatial_info(rate_maps, pos_map):
     
     # Handle pos_map based on its type
     if single_pos_map:
-        # Use the same position map for each rate map
-        pos_maps_list = [pos_map for _ in range(len(rate_maps_list))]
+        # Use the same position map for each rate map, broadcast across the stack of rate maps
+        pos_maps_list = [pos_map]
     elif is_dict_pos_map:
         # Use corresponding position maps from dict
         pos_maps_list = [pos_map[key] for key in keys]
@@ -43,20 +43,23 @@ def spatial_info(rate_maps, pos_map):
     pos_maps_array = np.array(pos_maps_list)
 
     total_occupancy = np.nansum(pos_maps_array, axis=(1,2))
-    mean_rates = np.nansum(rate_maps_array * pos_maps_array, axis=(1,2)) / np.nansum(pos_maps_array, axis=(1,2))
+    mean_rates = np.nansum(rate_maps_array * pos_maps_array, axis=(1,2)) / total_occupancy
 
     # Make probability maps
     p_x = pos_maps_array / total_occupancy[:, None, None]
-    p_r = rate_maps_array / mean_rates[:, None, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_r = rate_maps_array / mean_rates[:, None, None]
 
     # Replace NaNs and infinities in rate_maps_array and p_r
     rate_maps_array = np.nan_to_num(rate_maps_array)
     p_r = np.nan_to_num(p_r)
 
-    # Calculate spatial information
+    # Calculate spatial information for all rate maps at once. Silent cells carry no information
+    silent = mean_rates == 0
     with np.errstate(divide='ignore', invalid='ignore'):
-        bits_per_sec_array = np.array([np.nansum(p_x * rate_map * np.log2(p_r_i)) if mean_rate != 0 else 0 for rate_map, p_r_i, mean_rate in zip(rate_maps_array, p_r, mean_rates) if mean_rate != 0])
-    bits_per_spike_array = bits_per_sec_array / mean_rates
+        bits_per_sec_array = np.nansum(p_x * rate_maps_array * np.log2(p_r), axis=(1,2))
+    bits_per_sec_array[silent] = 0
+    bits_per_spike_array = np.divide(bits_per_sec_array, mean_rates, out=np.zeros_like(bits_per_sec_array), where=~silent)
 
     
     # Prepare output format to match input format
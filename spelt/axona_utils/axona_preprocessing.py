@@ -255,81 +255,52 @@ def pos_from_bin(path):
                'data_start'
                 ]
 
-    # read in data and extract position data
-    with open(f'{path}.bin', 'rb') as f:
-        data = f.read()
+    # extract position data from the .bin file, which is memory-mapped rather than read in
+    # Each 432 byte packet starts with a 4 byte ID. ADU2 packets hold 10 little-endian 2 byte position values from byte 12:
+    # packet #, video timestamp, y1, x1, y2, x2, numpix1, numpix2, total_pix, unused value
+    packet_dtype = np.dtype([('id', 'S4'), ('header', 'V8'), ('pos', '<u2', (10,)), ('data', 'V400')])
 
-    position_data = []
-    packetnums = []
-    timestamps = []
-    x1s = []
-    y1s = []
-    x2s = []
-    y2s = []
-    numpix1s = []
-    numpix2s = []
-    totalpixs = []
-
-    for i in range(432, len(data)-432, 432): #skip first packet because it can be bugged (says Jim)
-        packet = data[i:i+432]
-        packet_id = packet[0:4].decode('ascii')
+    # Parse all packets at once, skipping the first packet because it can be bugged (says Jim), and the last packet
+    # (size - 433) // 432 counts whole packets after the first and stops short of the last one
+    n_packets = max(0, (os.path.getsize(f'{path}.bin') - 433) // 432)
+    if n_packets == 0:
+        # np.memmap cannot map an empty region
+        packets = np.zeros(0, dtype=packet_dtype)
+    else:
+        packets = np.memmap(f'{path}.bin', dtype=packet_dtype, mode='r', offset=432, shape=(n_packets,))
 
-        if packet_id == 'ADU2':
-            pos_sample = packet[12:32]
+    # Only keep every second ADU2 packet because pos data is double-counted in the .bin file
+    pos_packets = np.flatnonzero(packets['id'] == b'ADU2')[::2]
+    pos_samples = packets['pos'][pos_packets]
 
-            #Flip digits in pos data for saving (this is how they are in the .pos relative to the .bin)
-            pos_first = pos_sample[::2]
-            pos_second = pos_sample[1::2]
-            pos_sample = []
-            for n, i in enumerate(pos_first):
-                pos_sample.append(pos_second[n])
-                pos_sample.append(pos_first[n])
-                
-            packetnums.append(int.from_bytes(bytes(pos_sample[0:2]), 'big'))
-            timestamps.append(int.from_bytes(bytes(pos_sample[2:4]), 'big'))
-            y1s.append(int.from_bytes(bytes(pos_sample[4:6]), 'big'))
-            x1s.append(int.from_bytes(bytes(pos_sample[6:8]), 'big'))
-            y2s.append(int.from_bytes(bytes(pos_sample[8:10]), 'big'))
-            x2s.append(int.from_bytes(bytes(pos_sample[10:12]), 'big'))
-            numpix1s.append(int.from_bytes(bytes(pos_sample[12:14]), 'big'))
-            numpix2s.append(int.from_bytes(bytes(pos_sample[14:16]), 'big'))
-            totalpixs.append(int.from_bytes(bytes(pos_sample[16:18]), 'big'))
-            
-            # the X and Y values are reversed piece-wise so lets switch the format from
-            # packet #, video timestamp, y1, x1, y2, x2, numpix1, numpix2, total_pix, unused value
-            # to
-            # packet #, video timestamp, x1, y1, x2, y2, numpix1, numpix2, total_pix, unused value
-            y1 = pos_sample[4:6]
-            x1 = pos_sample[6:8]
-            y2 = pos_sample[8:10]
-            x2 = pos_sample[10:12]
-            
-            pos_sample[4:6] = x1
-            pos_sample[6:8] = y1
-            pos_sample[8:10] = x2
-            pos_sample[10:12] = y2
-            
-            pos_sample = bytes(pos_sample)
+    packetnums, timestamps, y1s, x1s, y2s, x2s, numpix1s, numpix2s, totalpixs = pos_samples[:, :9].T
 
-    #         if len(position_data) < (trial_duration*50*2) +1:
-            position_data.append(pos_sample)
+    # Flip digits in pos data for saving (this is how they are in the .pos relative to the .bin), and
+    # switch the X and Y values so the format is
+    # packet #, video timestamp, x1, y1, x2, y2, numpix1, numpix2, total_pix, unused value
+    # Both are done with a single permutation of the raw bytes of each sample
+    value_order = np.array([0, 1, 3, 2, 5, 4, 6, 7, 8, 9])
+    byte_order = np.column_stack([2 * value_order + 1, 2 * value_order]).ravel()
+    position_data = pos_samples.view(np.uint8)[:, byte_order]
 
-    # Drop every second sample because pos data is double-counted in the .bin file
-    position_data = position_data[::2]
-
-    # save position data to csv
-    pos_df = pd.DataFrame([packetnums, timestamps, x1s, x2s, y1s, y2s, numpix1s, numpix2s, totalpixs], 
-                          index = ['Packet Number', 'Timestamps', 'X1', 'X2', 'Y1', 'Y2', 'Pixels LED 1', 'Pixels LED 2', 'Total Pixels'])
-    pos_df = pos_df.iloc[:, ::2]
-    pos_df = pos_df.set_axis(range(pos_df.shape[1]), axis = 1)
-    pos_df.to_csv(f'{path}_pos.csv')
+    # save position data to csv, with a row for each variable and a column for each sample
+    pos_csv = np.vstack([packetnums, timestamps, x1s, x2s, y1s, y2s, numpix1s, numpix2s, totalpixs])
+    pos_csv_labels = ['Packet Number', 'Timestamps', 'X1', 'X2', 'Y1', 'Y2', 'Pixels LED 1', 'Pixels LED 2', 'Total Pixels']
+    with open(f'{path}_pos.csv', 'w') as f:
+        if pos_csv.shape[1] == 0:
+            # No samples: write the labels alone, as pandas does for a frame with no columns
+            f.write('""\n' + ''.join(f'{label}\n' for label in pos_csv_labels))
+        else:
+            f.write(',')
+            np.savetxt(f, np.arange(pos_csv.shape[1])[np.newaxis], fmt='%d', delimiter=',')
+            for label, row in zip(pos_csv_labels, pos_csv):
+                f.write(f'{label},')
+                np.savetxt(f, row[np.newaxis], fmt='%d', delimiter=',')
 
     # save position data to binary file
     with open(f'{path}.pos', 'wb') as f:
-        for line in header:
-            f.write(line.encode())
-        for pos_sample in position_data:
-            f.write(pos_sample)
+        f.write(''.join(header).encode())
+        f.write(position_data.tobytes())
         f.write('\r\ndata_end\r\n'.encode())
 
         f.close()
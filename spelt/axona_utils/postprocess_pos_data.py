@@ -1,7 +1,7 @@
 import struct
 import numpy as np
 import pandas as pd
-from scipy.ndimage import uniform_filter
+from scipy.ndimage import uniform_filter1d
 from scipy.interpolate import interp1d
 
 def write_csv_from_pos(file_path):
@@ -165,7 +165,7 @@ def interpolate_nan_values(df):
 
 def boxcar_smooth(df, window_size):
     """
-    This function applies a boxcar (moving average) smoothing to the DataFrame using scipy's boxcar function.
+    This function applies a boxcar (moving average) smoothing to each row of the DataFrame using scipy's uniform_filter1d.
     It also interpolates between existing values to handle NaN values and fills remaining NaNs.
 
     Parameters:
@@ -175,13 +175,14 @@ def boxcar_smooth(df, window_size):
     Returns:
     df_smoothed: DataFrame with smoothed values
     """
-    from scipy.signal import convolve, boxcar
-
-    # Create a boxcar window
-    window = boxcar(window_size)
-
-    # Apply boxcar smoothing
-    df_smoothed = df.apply(lambda x: pd.Series(convolve(x, window, mode='same') / window_size), axis=1)
+    values = df.to_numpy(dtype=float)
+    nan_mask = np.isnan(values)
+
+    # Apply boxcar smoothing along each row as a running mean, with zero padding at the ends.
+    # NaNs are zeroed so the running sum does not carry them along the row, and any window containing a NaN is reset to NaN
+    smoothed = uniform_filter1d(np.where(nan_mask, 0, values), window_size, axis=1, mode='constant')
+    smoothed[uniform_filter1d(nan_mask.astype(float), window_size, axis=1, mode='constant') > 0] = np.nan
+    df_smoothed = pd.DataFrame(smoothed, index=df.index)
 
     # Interpolate between existing values to handle NaN values
     df_smoothed = df_smoothed.interpolate(method='linear', axis=0)
@@ -1,5 +1,5 @@
+import math
 import numpy as np
-from scipy.ndimage import convolve
 
 def create_circular_kernel(radius):
     """
@@ -18,6 +18,37 @@ def create_circular_kernel(radius):
     kernel[mask] = 1
     return kernel
 
+def circular_kernel_sum(arr, radius):
+    """
+    Sum values within a flat, circular kernel centred on each bin.
+
+    Equivalent, up to floating-point rounding, to convolving with create_circular_kernel(radius) and zero
+    padding, but the circle is split into horizontal runs that are each summed from cumulative sums along
+    the rows. This scales with the radius rather than the kernel area. Sums of integer maps are exact.
+
+    Args:
+        arr (ndarray): Array of maps to filter. The last two axes are filtered.
+        radius (int): Radius of the circular kernel.
+
+    Returns:
+        ndarray: Array of the same shape as `arr` with the summed values.
+    """
+    n_rows, n_cols = arr.shape[-2:]
+
+    # Zero-pad rows by the radius, and columns by the radius plus a leading zero for the cumulative sum
+    pad_width = [(0, 0)] * (arr.ndim - 2) + [(radius, radius), (radius + 1, radius)]
+    row_sums = np.cumsum(np.pad(arr, pad_width), axis=-1)
+
+    kernel_sum = np.zeros(arr.shape, dtype=row_sums.dtype)
+    for row_offset in range(-radius, radius + 1):
+        # Half-width of the circle at this row offset
+        half_width = math.isqrt(radius**2 - row_offset**2)
+        rows = row_sums[..., radius + row_offset:radius + row_offset + n_rows, :]
+        kernel_sum += rows[..., radius + 1 + half_width:radius + 1 + half_width + n_cols]
+        kernel_sum -= rows[..., radius - half_width:radius - half_width + n_cols]
+
+    return kernel_sum
+
 def update_smoothed_maps(smoothed_spk, smoothed_pos, f_spk, f_pos, f_vis, bins_passed):
     """
     Update the smoothed spike and position maps.
@@ -38,8 +69,8 @@ def finalize_smoothed_rate_map(smoothed_spk, smoothed_pos, pos_map):
     Finalize the smoothed rate map.
 
     Args:
-        smoothed_spk (ndarray): Smoothed spike map.
-        smoothed_pos (ndarray): Smoothed position map.
+        smoothed_spk (ndarray): Smoothed spike map, or stacked spike maps.
+        smoothed_pos (ndarray): Smoothed position map, or stacked position maps.
         pos_map (ndarray): Original position map.
 
     Returns:
@@ -47,7 +78,7 @@ def finalize_smoothed_rate_map(smoothed_spk, smoothed_pos, pos_map):
     """
     with np.errstate(divide='ignore', invalid='ignore'):
         smoothed_rate = smoothed_spk / smoothed_pos
-    smoothed_rate[pos_map == 0] = np.nan
+    smoothed_rate[..., pos_map == 0] = np.nan
     return smoothed_rate
 
 def handle_empty_maps(spk_map, pos_map):
@@ -65,37 +96,54 @@ def handle_empty_maps(spk_map, pos_map):
     nan_map = np.full_like(pos_map, np.nan)
     return nan_map, nan_map, nan_map, np.nan
 
-def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
+def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None, pos_sampling_rate=None):
     """
     Apply adaptive smoothing to rate maps using a flat, circular kernel.
     Built to match the logic of scan(pix).maps.adaptiveSmooth.m by Thomas Wills
 
+    Several spike maps that share a position map can be smoothed together by stacking them along
+    the first axis, in which case every output is stacked in the same way.
+
     Args:
-        spk_map (ndarray): 2D array representing the spike map.
+        spk_map (ndarray): 2D array representing the spike map, or 3D array of stacked spike maps.
         pos_map (ndarray): 2D array representing the position map.
         alpha (float): Alpha parameter for adaptive smoothing.
         max_radius (int, optional): Maximum allowed radius for the smoothing kernel. 
                                     Defaults to half of the smallest map dimension.
+        pos_sampling_rate (float, optional): Sampling rate the position map was normalised by. If given, the
+                                    position map is summed as whole sample counts, which is exact, so ties in
+                                    the smoothing criterion resolve deterministically. Defaults to None.
 
     Returns:
         smoothed_spk (ndarray): Smoothed spike map.
         smoothed_pos (ndarray): Smoothed position map.
         smoothed_rate (ndarray): Smoothed rate map.
-        median_radius (float): Median radius used in the smoothing process.
+        median_radius (float or ndarray): Median radius used in the smoothing process.
     """
     if max_radius is None:
-        max_radius = min(spk_map.shape) // 2
+        max_radius = min(spk_map.shape[-2:]) // 2
 
-    # Check for empty spike map
-    if np.sum(spk_map) == 0:
-        return handle_empty_maps(spk_map, pos_map)
+    # Smooth a single map as a stack of one
+    if spk_map.ndim == 2:
+        # Check for empty spike map
+        if np.sum(spk_map) == 0:
+            return handle_empty_maps(spk_map, pos_map)
+
+        smoothed_spk, smoothed_pos, smoothed_rate, median_radius = adaptive_smooth(spk_map[np.newaxis], pos_map, alpha, max_radius, pos_sampling_rate)
+        return smoothed_spk[0], smoothed_pos[0], smoothed_rate[0], median_radius[0]
+
+    # Empty spike maps are not smoothed, and are returned as NaN
+    empty_maps = np.sum(spk_map, axis=(1, 2)) == 0
+    spk_map = spk_map[~empty_maps]
 
     # Initializations
-    smoothed_spk = np.zeros_like(spk_map)
-    smoothed_pos = np.zeros_like(pos_map)
+    smoothed_spk = np.zeros(spk_map.shape)
+    smoothed_pos = np.zeros(spk_map.shape)
     visited_template = (pos_map > 0).astype(int)
-    smoothed_check = (pos_map == 0)  # True for unvisited bins
-    radii_used_list = []
+    smoothed_check = np.broadcast_to(pos_map == 0, spk_map.shape).copy()  # True for unvisited bins
+    radii_counts = np.zeros((spk_map.shape[0], max_radius + 1), dtype=int)  # Number of bins smoothed at each radius
+    if pos_sampling_rate is not None:
+        pos_sample_counts = np.rint(pos_map * pos_sampling_rate).astype(int)  # Number of position samples in each bin
 
     # Main adaptive smoothing loop
     radius = 1
@@ -104,13 +152,15 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
         if radius > max_radius:
             break
 
-        # Construct filter kernel
-        kernel = create_circular_kernel(radius)
-
-        # Filter maps to get number of spikes and sum of positions within the kernel
-        f_spk = convolve(spk_map, kernel, mode='constant', cval=0.0)
-        f_pos = convolve(pos_map, kernel, mode='constant', cval=0.0)
-        f_vis = convolve(visited_template, kernel, mode='constant', cval=0.0)
+        # Filter maps with a circular kernel to get number of spikes and sum of positions within the kernel
+        # Position and visited maps are shared, so are filtered once for all spike maps
+        f_spk = circular_kernel_sum(spk_map, radius)
+        if pos_sampling_rate is None:
+            f_pos = circular_kernel_sum(pos_map, radius)
+        else:
+            f_pos = circular_kernel_sum(pos_sample_counts, radius) / pos_sampling_rate
+        f_pos = np.broadcast_to(f_pos, spk_map.shape)
+        f_vis = np.broadcast_to(circular_kernel_sum(visited_template, radius), spk_map.shape)
 
         # Determine which bins meet the criteria at this radius
         with np.errstate(divide='ignore'):
@@ -122,7 +172,7 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
         smoothed_check[bins_passed] = True
 
         # Record radii used
-        radii_used_list.extend([radius] * np.sum(bins_passed))
+        radii_counts[:, radius] = np.sum(bins_passed, axis=(1, 2))
 
         # Increase circle radius
         radius += 1
@@ -131,6 +181,14 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
     smoothed_rate = finalize_smoothed_rate_map(smoothed_spk, smoothed_pos, pos_map)
 
     # Compute median filter radius
-    median_radius = np.nanmedian(radii_used_list)
+    radii = np.arange(max_radius + 1)
+    median_radius = np.array([np.nanmedian(np.repeat(radii, counts)) for counts in radii_counts])
+
+    # Insert smoothed maps back amongst the empty maps
+    outputs = []
+    for smoothed in (smoothed_spk, smoothed_pos, smoothed_rate, median_radius):
+        output = np.full(empty_maps.shape + smoothed.shape[1:], np.nan)
+        output[~empty_maps] = smoothed
+        outputs.append(output)
 
-    return smoothed_spk, smoothed_pos, smoothed_rate, median_radius
+    return tuple(outputs)
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from scipy.ndimage import uniform_filter
 import matplotlib.pyplot as plt
 from spelt.maps.adaptive_smooth import *
 
@@ -53,50 +52,61 @@ def make_rate_maps(spike_data, pos_sample_times, pos_bin_idx, pos_sampling_rate,
     else:
         raise TypeError("spike_data must be a dictionary or a 1D numpy array")
 
-    bins = [np.arange(0, pos_bin_idx[0].max() + 1), np.arange(0, pos_bin_idx[1].max() + 1)]
+    # Bins are uniform and already indexed, so maps can be built with np.bincount on a flat index
+    # The largest index is folded into the last bin, matching np.histogram2d with integer bin edges
+    x_bins = int(pos_bin_idx[0].max())
+    y_bins = int(pos_bin_idx[1].max())
+    x_bin_idx = np.minimum(pos_bin_idx[0], x_bins - 1)
+    y_bin_idx = np.minimum(pos_bin_idx[1], y_bins - 1)
+    flat_pos_idx = x_bin_idx * y_bins + y_bin_idx
 
     # Compute the 2D occupancy map
-    pos_map, _, _ = np.histogram2d(pos_bin_idx[0], pos_bin_idx[1], bins=bins)
+    pos_map = np.bincount(flat_pos_idx, minlength=x_bins * y_bins).reshape(x_bins, y_bins).astype(float)
     # Normalize by the sampling rate to give seconds per bin. This ensures that rate maps are in units of Hz
     pos_map /= pos_sampling_rate
         
-    # Initialize the rate maps dictionary with zeros using cluster keys
-    rate_maps_dict = {cluster: np.zeros_like(pos_map) for cluster in spike_data.keys()}
-    max_rates_dict = {cluster: [np.nan] for cluster in spike_data.keys()}
-    mean_rates_dict = {cluster: [np.nan] for cluster in spike_data.keys()}
-         
-    # Populate the rate maps based on spike times
-    for cluster, spike_times in spike_data.items():
-        # Find the corresponding bins for each spike time
-        binned_spikes = np.digitize(spike_times, pos_sample_times) - 1
-        # Make spike map
-        spike_map, _, _ = np.histogram2d(pos_bin_idx[0][binned_spikes], pos_bin_idx[1][binned_spikes], bins=bins)
-
-        # Set spike count to 0 where occupancy is 0 to avoid division by 0
-        spike_map[pos_map == 0] = 0
-
-        # Smooth the spike map using an adaptive kernel
-        if adaptive_smoothing:
-            _, pos_map, rate_map, _ = adaptive_smooth(spike_map, pos_map, alpha)
-            rate_maps_dict[cluster] = rate_map
-        else:
-            # Calculate the raw rate map by dividing spike count by occupancy time (plus a small constant)
-            raw_rate_map = spike_map / (pos_map * dt + 1e-10)
-            # Return raw rate and pos map if adaptive smoothing is not used
-            rate_maps_dict[cluster] = raw_rate_map
-
-        if max_rates == True:
-            # Calculate max and mean firing rates
-            max_rates_dict[cluster] = np.nanmax(rate_maps_dict[cluster])
-            mean_rates_dict[cluster] = np.nanmean(rate_maps_dict[cluster])
-                
+    # Pool spikes from all clusters, labelling each spike with the index of its cluster
+    n_clusters = len(spike_data)
+    n_spikes = [len(spike_times) for spike_times in spike_data.values()]
+    all_spike_times = np.concatenate(list(spike_data.values())) if n_clusters > 0 else np.array([])
+    cluster_idx = np.repeat(np.arange(n_clusters), n_spikes)
+
+    # Find the corresponding position sample for each spike time
+    binned_spikes = np.searchsorted(pos_sample_times, all_spike_times, side='right') - 1
+    # Drop spikes that occur before the first position sample
+    valid_spikes = binned_spikes >= 0
+
+    # Make spike maps for all clusters at once, offsetting each cluster by the number of bins in a map
+    n_bins = x_bins * y_bins
+    flat_spike_idx = cluster_idx[valid_spikes] * n_bins + flat_pos_idx[binned_spikes[valid_spikes]]
+    spike_maps = np.bincount(flat_spike_idx, minlength=n_clusters * n_bins).reshape(n_clusters, x_bins, y_bins).astype(float)
+    # Every spike is binned at a position sample that also counts towards occupancy, so spike counts are already 0
+    # wherever occupancy is 0
+
+    if adaptive_smoothing:
+        # Smooth all spike maps at once using an adaptive kernel
+        _, smoothed_pos_maps, rate_maps, _ = adaptive_smooth(spike_maps, pos_map, alpha, pos_sampling_rate=pos_sampling_rate)
+        # Return the smoothed position map, taken from the last cluster if there are several
+        if n_clusters > 0:
+            pos_map = smoothed_pos_maps[-1]
+    else:
+        # Calculate the raw rate maps by dividing spike counts by occupancy time (plus a small constant)
+        rate_maps = spike_maps / (pos_map * dt + 1e-10)
+
     # Set pos map to NaN where occupancy is 0
     pos_map[pos_map == 0] = np.nan
 
-    # Before returning, transpose the arrays to account for an axis transformation that np.histogram2D does
-    rate_maps_dict = {cluster: rate_map.T for cluster, rate_map in rate_maps_dict.items()}
+    # Before returning, transpose the arrays to account for an axis transformation from indexing maps as (x, y)
+    rate_maps = rate_maps.transpose(0, 2, 1)
     pos_map = pos_map.T
 
+    rate_maps_dict = dict(zip(spike_data.keys(), rate_maps))
+
+    if max_rates == True:
+        # Calculate max and mean firing rates
+        max_rates_dict = dict(zip(spike_data.keys(), np.nanmax(rate_maps, axis=(1, 2))))
+        mean_rates_dict = dict(zip(spike_data.keys(), np.nanmean(rate_maps, axis=(1, 2))))
+
     # If only one rate map, convert to array
     if return_dict == False:
         rate_maps_dict = rate_maps_dict[0]
@@ -122,7 +132,9 @@ def plot_cluster_across_session(rate_maps_dict, cluster_id, max_rates_dict, mean
         session (str, optional): The session identifier. Defaults to "N/A".
         age (int, optional): The age of the cluster. Defaults to None.
     """
-    n_sessions = sum(cluster_id in sub_dict for sub_dict in rate_maps_dict.values())
+    # Find the sessions containing the cluster once, rather than checking every session again while plotting
+    sessions_with_cluster = [session_key for session_key, sub_dict in rate_maps_dict.items() if cluster_id in sub_dict]
+    n_sessions = len(sessions_with_cluster)
     
     if n_sessions == 0:
         print(f"Cluster {cluster_id} is not found in any session.")
@@ -135,22 +147,19 @@ def plot_cluster_across_session(rate_maps_dict, cluster_id, max_rates_dict, mean
     # Convert axes to list if there is only one session
     if n_sessions == 1:
         axes = [axes]
-    ax_idx = 0
     
     # Plot rate maps for each session
-    for session_key, sub_dict in rate_maps_dict.items():
-        if cluster_id in sub_dict:
-            try:
-                rate_map = sub_dict[cluster_id]
-                axes[ax_idx].imshow(rate_map, cmap='jet', origin='lower', vmin = 0)
-                axes[ax_idx].set_title(f"Trial {session_key}.\nMax FR: {max_rates_dict[session_key][cluster_id]:.2f} Hz. Mean FR: {mean_rates_dict[session_key][cluster_id]:.2f} Hz\n Spatial Info: {spatial_info_dict[session_key][cluster_id]:.2f}. P = {spatial_significance_dict[session_key][cluster_id]}")
-                axes[ax_idx].invert_yaxis() # Needed to match rate maps to theta phase plots
-                axes[ax_idx].axis('off')
-                # plt.colorbar(im, ax=axes[ax_idx])
-            except KeyError:
-                # print(f"Cluster {cluster_id} is missing trial {ax_idx}.")
-                pass
-            ax_idx += 1
+    for ax_idx, session_key in enumerate(sessions_with_cluster):
+        try:
+            rate_map = rate_maps_dict[session_key][cluster_id]
+            axes[ax_idx].imshow(rate_map, cmap='jet', origin='lower', vmin = 0)
+            axes[ax_idx].set_title(f"Trial {session_key}.\nMax FR: {max_rates_dict[session_key][cluster_id]:.2f} Hz. Mean FR: {mean_rates_dict[session_key][cluster_id]:.2f} Hz\n Spatial Info: {spatial_info_dict[session_key][cluster_id]:.2f}. P = {spatial_significance_dict[session_key][cluster_id]}")
+            axes[ax_idx].invert_yaxis() # Needed to match rate maps to theta phase plots
+            axes[ax_idx].axis('off')
+            # plt.colorbar(im, ax=axes[ax_idx])
+        except KeyError:
+            # print(f"Cluster {cluster_id} is missing trial {ax_idx}.")
+            pass
 
 
 def speed_filter_spikes(current_trial_spikes, speed_data, position_sampling_rate, speed_lower_bound, speed_upper_bound):
@@ -170,24 +179,27 @@ def speed_filter_spikes(current_trial_spikes, speed_data, position_sampling_rate
     filtered_spikes = {}
     
     sampling_interval = 1 / position_sampling_rate
+
+    # Pool spikes from all clusters so that speeds are looked up in a single pass
+    n_spikes = [len(spikes) for spikes in current_trial_spikes.values()]
+    all_spikes = np.concatenate(list(current_trial_spikes.values())) if current_trial_spikes else np.array([])
+
+    # Convert spikes to closest speed index
+    closest_indices = np.round(all_spikes / sampling_interval).astype(int)
     
-    for cluster, spikes in current_trial_spikes.items():
-        # Convert spikes to closest speed index
-        closest_indices = np.round(spikes / sampling_interval).astype(int)
-        
-        # Pre-filter indices that are out of bounds
-        valid_indices = (closest_indices >= 0) & (closest_indices < len(speed_data))
-        closest_indices = closest_indices[valid_indices]
-        spikes = spikes[valid_indices]
-        
-        # Retrieve speeds at the closest indices
-        speeds_at_spikes = speed_data[closest_indices]
-        
-        # Check which speeds are within the specified range
-        valid_speeds = (speed_lower_bound <= speeds_at_spikes) & (speeds_at_spikes <= speed_upper_bound)
-        
-        # Update the dictionary with filtered spikes for this cluster
-        filtered_spikes[cluster] = spikes[valid_speeds]
+    # Pre-filter indices that are out of bounds
+    valid_spikes = (closest_indices >= 0) & (closest_indices < len(speed_data))
+    
+    # Retrieve speeds at the closest indices
+    speeds_at_spikes = speed_data[closest_indices[valid_spikes]]
+    
+    # Check which speeds are within the specified range
+    valid_spikes[valid_spikes] = (speed_lower_bound <= speeds_at_spikes) & (speeds_at_spikes <= speed_upper_bound)
+    
+    # Split the pooled mask back into clusters and update the dictionary with filtered spikes
+    cluster_masks = np.split(valid_spikes, np.cumsum(n_spikes)[:-1])
+    for (cluster, spikes), cluster_mask in zip(current_trial_spikes.items(), cluster_masks):
+        filtered_spikes[cluster] = spikes[cluster_mask]
         
     return filtered_spikes
 
@@ -237,11 +249,12 @@ def bin_pos_data_axona(pos_data, bin_length = 2.5, speed_threshold = 2.5):
     x_bin_edges = np.linspace(min_x, max_x, x_bins + 1)
     y_bin_edges = np.linspace(min_y, max_y, y_bins + 1)
    
-    # Impute missing values (NaNs) in the 'positions' DataFrame with their respective mean values
-    positions.fillna(positions.mean(), inplace=True)
-    
-    # Extract x and y coordinates and their corresponding timestamps from the DataFrame
-    x_coords, y_coords = positions.values[0, :], positions.values[1, :]
+    # Extract x and y coordinates from the DataFrame
+    xy_coords = positions.to_numpy(dtype=float)
+
+    # Impute missing values (NaNs) in the x and y coordinates with their respective mean values
+    xy_coords = np.where(np.isnan(xy_coords), np.nanmean(xy_coords, axis=1, keepdims=True), xy_coords)
+    x_coords, y_coords = xy_coords[0, :], xy_coords[1, :]
 
     # Speed filter
     speed_mask = speed >= speed_threshold
@@ -291,10 +304,6 @@ def bin_pos_data_dlc(pos_data, bin_length = 2.5, speed_threshold = 2.5):
     min_y_raw = np.floor_divide(min(positions.loc['Y']), bin_length) * bin_length
     max_y_raw = np.ceil(max(positions.loc['Y']) / bin_length) * bin_length
 
-    # TRANSLATE POSITION VALUES SO THAT MIN X and Y ARE 0 - TEMP
-    positions.loc['X'] = positions.loc['X'] - min_x_raw
-    positions.loc['Y'] = positions.loc['Y'] - min_y_raw
-    
     # They are then scaled so that the NW corner is (0,0) to match the position data
     min_x = 0
     max_x = max_x_raw - min_x_raw
@@ -309,11 +318,15 @@ def bin_pos_data_dlc(pos_data, bin_length = 2.5, speed_threshold = 2.5):
     x_bin_edges = np.linspace(min_x, max_x, x_bins + 1)
     y_bin_edges = np.linspace(min_y, max_y, y_bins + 1)
    
-    # Impute missing values (NaNs) in the 'positions' DataFrame with their respective mean values
-    positions.fillna(positions.mean(), inplace=True)
-    
-    # Extract x and y coordinates and their corresponding timestamps from the DataFrame
-    x_coords, y_coords = positions.values[0, :], positions.values[1, :]
+    # Extract x and y coordinates from the DataFrame
+    xy_coords = positions.to_numpy(dtype=float)
+
+    # TRANSLATE POSITION VALUES SO THAT MIN X and Y ARE 0 - TEMP
+    xy_coords = xy_coords - np.array([[min_x_raw], [min_y_raw]])
+
+    # Impute missing values (NaNs) in the x and y coordinates with their respective mean values
+    xy_coords = np.where(np.isnan(xy_coords), np.nanmean(xy_coords, axis=1, keepdims=True), xy_coords)
+    x_coords, y_coords = xy_coords[0, :], xy_coords[1, :]
 
     # Speed filter
     speed_mask = speed >= speed_threshold